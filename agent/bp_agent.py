@@ -1,9 +1,39 @@
 """Blood Pressure Agent for generating guidance via OpenAI."""
 
+import atexit
+import hashlib
+import json
+import logging
 import os
-from typing import Optional
+import threading
+from typing import Any, Iterator, Optional
 
+import httpx
 import openai
+import pandas as pd
+from cachetools import TTLCache
+from openai.types import CompletionUsage
+
+logger = logging.getLogger(__name__)
+
+# Guidance keyed by generation settings, exact vitals and normalized symptoms,
+# shared by all agents.
+_GUIDANCE_CACHE: TTLCache = TTLCache(maxsize=512, ttl=3600)
+_GUIDANCE_CACHE_LOCK = threading.Lock()
+
+# The OpenAI client retries 429/5xx with exponential backoff; the transport
+# separately retries failed connection attempts before that kicks in.
+_MAX_RETRIES = 4
+_TIMEOUT = httpx.Timeout(90.0, connect=3.0)
+_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=40)
+
+# One keep-alive HTTP/2 pool for every agent, so new instances skip TCP/TLS setup.
+# httpx ignores http2/limits on the client once a transport is given.
+_SHARED_HTTPX = openai.DefaultHttpxClient(
+    transport=httpx.HTTPTransport(http2=True, retries=2, limits=_LIMITS),
+    timeout=_TIMEOUT,
+)
+atexit.register(_SHARED_HTTPX.close)
 
 SYSTEM_PROMPT = """\
 You are an expert health advisor specializing in cardiovascular health
@@ -63,12 +93,223 @@ Structure your response with the following sections:
 - How to track progress
 
 Be encouraging but honest. Use specific numbers and actionable advice.
+Keep each section to a few tight bullets; the whole report must stay under
+600 words.
 Never end with questions—provide clear next steps instead.
 Include a disclaimer that this is educational guidance,
 not a substitute for professional medical advice.
+
+# Reference Data
+
+Base your classification and recommendations on the reference tables below.
+Quote the relevant values rather than reproducing entire tables.
+
+## ACC/AHA Blood Pressure Categories (adults)
+
+| Category             | Systolic (mmHg) |        | Diastolic (mmHg) |
+|----------------------|-----------------|--------|------------------|
+| Normal               | < 120           | and    | < 80             |
+| Elevated             | 120-129         | and    | < 80             |
+| Stage 1 Hypertension | 130-139         | or     | 80-89            |
+| Stage 2 Hypertension | >= 140          | or     | >= 90            |
+| Hypertensive Crisis  | > 180           | and/or | > 120            |
+
+When systolic and diastolic fall into different categories, use the higher one.
+A crisis-range reading with chest pain, shortness of breath, back pain,
+numbness, weakness, vision change, or difficulty speaking is an emergency:
+advise calling emergency services immediately.
+
+## Resting Heart Rate (adults)
+
+| Range (bpm) | Interpretation                                             |
+|-------------|------------------------------------------------------------|
+| < 50        | Marked bradycardia; evaluate if dizzy, faint, or fatigued  |
+| 50-59       | Bradycardia; often normal in trained or athletic adults    |
+| 60-100      | Normal resting range                                       |
+| 101-120     | Tachycardia; recheck after 5 minutes of seated rest        |
+| > 120       | Marked tachycardia; seek prompt evaluation if persistent   |
+
+## Expected Systolic Reduction from Lifestyle Changes
+
+| Intervention                 | Target                                 | Approx. drop |
+|------------------------------|----------------------------------------|--------------|
+| Weight loss                  | Toward ideal body weight               | ~1 per kg    |
+| DASH eating pattern          | Fruits, vegetables, low-fat dairy      | 8-11 mmHg    |
+| Sodium reduction             | < 1,500 mg/day or cut >= 1,000 mg/day  | 5-6 mmHg     |
+| Dietary potassium            | 3,500-5,000 mg/day from food           | 4-5 mmHg     |
+| Aerobic exercise             | 90-150 min/week                        | 5-8 mmHg     |
+| Dynamic resistance training  | 90-150 min/week                        | ~4 mmHg      |
+| Isometric resistance         | Handgrip, 4 x 2 min, 3 sessions/week   | ~5 mmHg      |
+| Alcohol moderation           | <= 2 drinks/day men, <= 1 women        | ~4 mmHg      |
+
+## DASH Daily Servings (2,000 kcal/day)
+
+| Food group                 | Servings         | Example serving                 |
+|----------------------------|------------------|---------------------------------|
+| Whole grains               | 6-8 per day      | 1 slice bread, 1/2 cup rice     |
+| Vegetables                 | 4-5 per day      | 1 cup raw leafy, 1/2 cup cooked |
+| Fruits                     | 4-5 per day      | 1 medium fruit, 1/2 cup fresh   |
+| Low-fat or fat-free dairy  | 2-3 per day      | 1 cup milk or yogurt            |
+| Lean meat, poultry, fish   | <= 6 oz per day  | 1 oz cooked meat, 1 egg         |
+| Nuts, seeds, legumes       | 4-5 per week     | 1/3 cup nuts, 1/2 cup beans     |
+| Fats and oils              | 2-3 per day      | 1 tsp vegetable oil             |
+| Sweets and added sugars    | <= 5 per week    | 1 tbsp sugar or jam             |
+
+## Sodium Targets
+
+| Situation                                     | Sodium limit      |
+|-----------------------------------------------|-------------------|
+| General adult population                      | < 2,300 mg/day    |
+| Elevated BP, hypertension, or ideal target    | < 1,500 mg/day    |
+| Minimum meaningful improvement                | Cut 1,000 mg/day  |
+
+Common high-sodium sources: deli and cured meats, canned soups, pizza,
+bread and rolls, frozen meals, savory snacks, soy sauce, and restaurant food.
+
+## Potassium-Rich Foods
+
+| Food (portion)                    | Potassium (mg) |
+|-----------------------------------|----------------|
+| Baked potato with skin (medium)   | ~925           |
+| White beans, cooked (1 cup)       | ~1,000         |
+| Spinach, cooked (1 cup)           | ~840           |
+| Lentils, cooked (1 cup)           | ~730           |
+| Plain low-fat yogurt (1 cup)      | ~530           |
+| Sweet potato, baked (medium)      | ~540           |
+| Avocado (1/2 fruit)               | ~490           |
+| Banana (medium)                   | ~420           |
+| Salmon, cooked (3 oz)             | ~380           |
+| Orange juice (1 cup)              | ~440           |
+
+Potassium caution: advise checking with a clinician before raising intake
+when kidney disease is present or when taking ACE inhibitors, ARBs, or
+potassium-sparing diuretics.
+
+## Exercise FITT Guidelines for Blood Pressure
+
+| Type        | Frequency     | Intensity                     | Time                 |
+|-------------|---------------|-------------------------------|----------------------|
+| Aerobic     | 5-7 days/week | Moderate (can talk, not sing) | 30-60 min/day        |
+| Resistance  | 2-3 days/week | Moderate, 8-12 reps per set   | 8-10 moves, 2-4 sets |
+| Isometric   | 3 days/week   | ~30% of max effort            | 4 x 2 min holds      |
+| Flexibility | 2-3 days/week | Mild tension, no pain         | Hold each 10-30 s    |
+
+Exercise cautions: breathe continuously and avoid breath-holding (Valsalva)
+during lifts. Readings >= 160/100 warrant medical clearance before vigorous
+or heavy resistance exercise. Do not exercise at >= 180/110; seek care.
+
+## Sleep and Recovery
+
+| Factor              | Recommendation                                        |
+|---------------------|-------------------------------------------------------|
+| Duration            | 7-9 hours per night for adults                        |
+| Schedule            | Consistent bed and wake times, including weekends     |
+| Sleep apnea signs   | Loud snoring, witnessed pauses, daytime sleepiness    |
+| Pre-sleep habits    | No caffeine after early afternoon, limit late alcohol |
+
+## Home Measurement Technique
+
+Sit quietly for 5 minutes with back supported and feet flat. Rest the arm
+at heart level with a correctly sized cuff on bare skin. Avoid caffeine,
+exercise, and smoking for 30 minutes beforehand. Take 2 readings 1 minute
+apart, morning and evening, and record the average.
 """
 
 
+# Served without an LLM call for symptom-free readings in the Normal range.
+_NORMAL_READING_GUIDANCE = """\
+## 📊 Blood Pressure Classification
+- Your reading of **{systolic}/{diastolic} mmHg** is **Normal** under ACC/AHA
+  guidelines (below 120/80)
+- A heart rate of **{heart_rate} bpm** is within the normal resting range of
+  60-100 bpm
+
+## ⚠️ Health Risk Assessment
+- This reading carries no added cardiovascular risk from blood pressure
+- Blood pressure tends to rise with age, so keeping these habits matters
+
+## 🥗 Dietary Recommendations
+- Keep sodium under 2,300 mg/day, ideally closer to 1,500 mg/day
+- Aim for 3,500-5,000 mg/day of potassium from foods such as potatoes,
+  beans, spinach, yogurt, and bananas
+- Follow a DASH-style pattern: 4-5 servings each of vegetables and fruit daily
+
+## 🏃 Exercise Plan
+- 150 minutes/week of moderate aerobic activity (e.g. 30 minutes, 5 days)
+- Resistance training 2-3 days/week, 8-12 reps per set
+
+## 😴 Sleep & Recovery
+- Sleep 7-9 hours on a consistent schedule, including weekends
+
+## 🧘 Stress Management
+- Take a few minutes daily for slow breathing or another relaxation practice
+
+## 📋 Lifestyle Modifications
+- Limit alcohol to 2 drinks/day for men and 1 for women, and avoid smoking
+
+## 🩺 When to Seek Medical Care
+- Recheck at least yearly with your healthcare provider
+- Seek care sooner for headaches, dizziness, or chest discomfort
+
+## 📈 Goal Setting
+- Stay below 120/80 and keep logging readings at the same times each day
+
+*This is educational guidance, not a substitute for professional medical
+advice.*
+"""
+
+# Appended when a report stops at max_completion_tokens. The prompt asks for
+# the disclaimer last, so a cut-off report is the one most likely to lack it.
+TRUNCATION_NOTICE = (
+    "\n\n---\n*Report truncated: this is not medical advice. Talk to a "
+    "healthcare provider about your reading.*\n"
+)
+
+# Built once so every request sends byte-identical prefix content; read-only.
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+_USER_TEMPLATE = (
+    "Systolic: {systolic}, Diastolic: {diastolic}, "
+    "Heart Rate: {heart_rate}, Symptoms: {symptoms}"
+)
+
+
+def _log_cache_metrics(usage: CompletionUsage | None) -> None:
+    """Log how many prompt tokens were served from OpenAI's prompt cache."""
+    if usage is None:
+        return
+    details = usage.prompt_tokens_details
+    cached = (details.cached_tokens or 0) if details else 0
+    logger.info("Prompt cache: %d/%d prompt tokens cached", cached, usage.prompt_tokens)
+
+
+def _guidance_cache_key(
+    model: str,
+    max_completion_tokens: int,
+    temperature: float,
+    systolic: int,
+    diastolic: int,
+    heart_rate: int,
+    symptoms: str,
+) -> tuple:
+    """Key on generation settings, exact vitals and hashed, normalized symptoms.
+
+    The cache is shared by every agent, so the settings that shape a report
+    belong in the key. Vitals are not bucketed: any bucket can straddle an
+    ACC/AHA or heart-rate boundary, and the cached report quotes the submitted
+    numbers verbatim.
+    """
+    symptoms_hash = hashlib.sha1(symptoms.strip().lower().encode()).hexdigest()
+    return (
+        model,
+        max_completion_tokens,
+        temperature,
+        systolic,
+        diastolic,
+        heart_rate,
+        symptoms_hash,
+    )
+
+
 class BPAgent:
     """Simple wrapper around OpenAI chat completions for BP guidance."""
 
@@ -77,28 +318,242 @@ class BPAgent:
         *,
         api_key: Optional[str] = None,
         model: str = "gpt-5-chat-latest",
+        max_completion_tokens: int = 1200,
+        temperature: float = 0.3,
     ) -> None:
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY env var (or api_key) is required")
-        self.client = openai.OpenAI(api_key=self.api_key)
+        self.client = openai.OpenAI(
+            api_key=self.api_key,
+            max_retries=_MAX_RETRIES,
+            timeout=_TIMEOUT,
+            http_client=_SHARED_HTTPX,
+        )
         self.model = model
+        self.max_completion_tokens = max_completion_tokens
+        self.temperature = temperature
 
     def generate_guidance(
         self, systolic: int, diastolic: int, heart_rate: int, symptoms: str
-    ) -> str:
-        """Produce AI guidance for a single blood pressure reading."""
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
+    ) -> Iterator[str]:
+        """
+        Stream AI guidance for a single blood pressure reading.
+
+        A report cut off by the token cap ends with :data:`TRUNCATION_NOTICE`
+        and is not cached.
+        """
+        canned = self._rule_based_guidance(systolic, diastolic, heart_rate, symptoms)
+        if canned is not None:
+            yield canned
+            return
+
+        key = _guidance_cache_key(
+            self.model,
+            self.max_completion_tokens,
+            self.temperature,
+            systolic,
+            diastolic,
+            heart_rate,
+            symptoms,
+        )
+        with _GUIDANCE_CACHE_LOCK:
+            cached = _GUIDANCE_CACHE.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        finish_reason = None
+        stream = self.client.chat.completions.create(
+            **self._completion_request(systolic, diastolic, heart_rate, symptoms)
+        )
+        for chunk in stream:
+            if chunk.choices:
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                token = choice.delta.content or ""
+                parts.append(token)
+                yield token
+            if chunk.usage:
+                _log_cache_metrics(chunk.usage)
+        if finish_reason == "length":
+            logger.warning("Guidance hit max_completion_tokens; not caching it")
+            yield TRUNCATION_NOTICE
+            return
+        with _GUIDANCE_CACHE_LOCK:
+            _GUIDANCE_CACHE[key] = "".join(parts)
+
+    @staticmethod
+    def _rule_based_guidance(
+        systolic: int, diastolic: int, heart_rate: int, symptoms: str
+    ) -> str | None:
+        """Return canned guidance for normal, symptom-free readings, else None."""
+        # Readings below 90/60 can indicate hypotension, so they go to the model.
+        if (
+            90 <= systolic < 120
+            and 60 <= diastolic < 80
+            and 60 <= heart_rate <= 100
+            and not symptoms.strip()
+        ):
+            return _NORMAL_READING_GUIDANCE.format(
+                systolic=systolic, diastolic=diastolic, heart_rate=heart_rate
+            )
+        return None
+
+    def _completion_request(
+        self,
+        systolic: int,
+        diastolic: int,
+        heart_rate: int,
+        symptoms: str,
+        *,
+        stream: bool = True,
+    ) -> dict[str, Any]:
+        """Build the chat completion arguments for one reading."""
+        request = {
+            "model": self.model,
+            "messages": (
+                _SYSTEM_MSG,
                 {
                     "role": "user",
-                    "content": (
-                        f"Systolic: {systolic}, Diastolic: {diastolic}, "
-                        f"Heart Rate: {heart_rate}, Symptoms: {symptoms}"
+                    "content": _USER_TEMPLATE.format(
+                        systolic=systolic,
+                        diastolic=diastolic,
+                        heart_rate=heart_rate,
+                        symptoms=symptoms,
                     ),
                 },
-            ],
+            ),
+            "max_completion_tokens": self.max_completion_tokens,
+            "temperature": self.temperature,
+        }
+        if stream:
+            request["stream"] = True
+            request["stream_options"] = {"include_usage": True}
+        return request
+
+    def generate_guidance_sync(
+        self, systolic: int, diastolic: int, heart_rate: int, symptoms: str
+    ) -> str:
+        """Produce the full guidance text for non-interactive callers."""
+        return "".join(
+            self.generate_guidance(systolic, diastolic, heart_rate, symptoms)
+        )
+
+    def submit_batch(self, readings: pd.DataFrame) -> tuple[str | None, dict[int, str]]:
+        """
+        Queue guidance for many stored readings through the OpenAI Batch API.
+
+        Batch requests are billed at half the synchronous rate and complete
+        within 24 hours, so use this for backfills rather than the UI.
+
+        Args:
+            readings: Frame with ``id``, ``sys``, ``dia`` and ``hr`` columns,
+                e.g. from :meth:`PostgresDB.get_readings_between`. Symptoms
+                are not stored, so stored readings are queued without them.
+
+        Returns:
+            The batch ID to pass to :meth:`poll_batch`, or None if nothing
+            needed the model, and the canned guidance for Normal readings,
+            keyed by reading ID, which the caller can save right away
+        """
+        canned = {}
+        lines = []
+        for reading in readings.to_dict("records"):
+            vitals = (int(reading["sys"]), int(reading["dia"]), int(reading["hr"]))
+            text = self._rule_based_guidance(*vitals, "")
+            if text is not None:
+                canned[int(reading["id"])] = text
+                continue
+            lines.append(
+                json.dumps(
+                    {
+                        "custom_id": str(reading["id"]),
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": self._completion_request(*vitals, "", stream=False),
+                    }
+                )
+            )
+        if not lines:
+            return None, canned
+        input_file = self.client.files.create(
+            file=("bp_guidance_batch.jsonl", "\n".join(lines).encode()),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
         )
-        return response.choices[0].message.content
+        return batch.id, canned
+
+    def poll_batch(self, batch_id: str) -> tuple[dict[int, str], set[int]] | None:
+        """
+        Check a batch submitted with :meth:`submit_batch`.
+
+        Args:
+            batch_id: ID returned by :meth:`submit_batch`
+
+        Returns:
+            None while the batch is still running. Once it has ended, the
+            guidance keyed by reading ID and the set of submitted reading IDs
+            that got none (failed, truncated, expired or cancelled), so a
+            backfill can resubmit them
+
+        Raises:
+            RuntimeError: If the batch failed validation and ran no requests
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+        if batch.status == "failed":
+            raise RuntimeError(f"Batch {batch_id} failed: {batch.errors}")
+
+        submitted = {
+            int(request["custom_id"])
+            for request in self._read_batch_file(batch.input_file_id)
+        }
+        guidance = {}
+        # Successful requests land in the output file and failed ones in the
+        # error file; either may be absent when every request went one way.
+        results = self._read_batch_file(batch.output_file_id)
+        results += self._read_batch_file(batch.error_file_id)
+        for result in results:
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                logger.warning(
+                    "Batch %s request %s failed: %s",
+                    batch_id,
+                    result["custom_id"],
+                    result.get("error") or response.get("body"),
+                )
+                continue
+            choice = response["body"]["choices"][0]
+            if choice.get("finish_reason") == "length":
+                logger.warning(
+                    "Batch %s request %s hit max_completion_tokens",
+                    batch_id,
+                    result["custom_id"],
+                )
+                continue
+            guidance[int(result["custom_id"])] = choice["message"]["content"]
+
+        missing = submitted - guidance.keys()
+        if missing:
+            logger.warning(
+                "Batch %s ended %s with %d of %d readings missing guidance",
+                batch_id,
+                batch.status,
+                len(missing),
+                len(submitted),
+            )
+        return guidance, missing
+
+    def _read_batch_file(self, file_id: str | None) -> list[dict[str, Any]]:
+        """Parse a Batch API JSONL file, treating a missing file as empty."""
+        if file_id is None:
+            return []
+        content = self.client.files.content(file_id)
+        return [json.loads(line) for line in content.text.splitlines() if line]
@@ -1,31 +1,66 @@
 """Database interface for the No Pressure app."""
 
 import os
+import threading
 from contextlib import contextmanager
 from datetime import date, datetime
-from typing import Generator
+from typing import Generator, Mapping
 
-import psycopg2
-from psycopg2.extensions import connection as PGConnection
-from psycopg2.extras import RealDictCursor
+import pandas as pd
+from psycopg import Connection, Cursor
+from psycopg_pool import ConnectionPool
+
+_RECENT_READINGS_SQL = """
+    SELECT id, timestamp, sys, dia, hr
+    FROM bp_readings
+    ORDER BY timestamp DESC
+    LIMIT %s
+"""
+
+
+# Vitals never exceed a few hundred, so they fit compact columnar storage.
+_READING_DTYPES = {"sys": "int16", "dia": "int16", "hr": "int16"}
+
+
+def _fetch_frame(cur: Cursor) -> pd.DataFrame:
+    """Materialize the cursor's result set as a DataFrame in one pass."""
+    frame = pd.DataFrame(cur.fetchall(), columns=[col.name for col in cur.description])
+    return frame.astype(
+        {col: dtype for col, dtype in _READING_DTYPES.items() if col in frame}
+    )
 
 
 class PostgresDB:
-    """Thin wrapper around a PostgreSQL connection for bp readings."""
+    """Thin wrapper around a pooled PostgreSQL connection for bp readings."""
 
     def __init__(self, *, db_url: str | None = None) -> None:
         self.db_url = db_url or os.getenv("DB_URL")
         if not self.db_url:
             raise ValueError("DB_URL env var (or db_url) is required")
+        self._pool: ConnectionPool | None = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ConnectionPool:
+        """Create the connection pool on first use."""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # Each write is a single statement (save_guidance opens
+                    # its own transaction), so skip the implicit BEGIN/COMMIT.
+                    self._pool = ConnectionPool(
+                        self.db_url,
+                        min_size=1,
+                        max_size=8,
+                        kwargs={"autocommit": True},
+                        open=True,
+                    )
+        return self._pool
 
     @contextmanager
-    def connection(self) -> Generator[PGConnection, None, None]:
-        """Yield an open psycopg2 connection that auto-closes."""
-        conn = psycopg2.connect(self.db_url)
-        try:
+    def connection(self) -> Generator[Connection, None, None]:
+        """Borrow a pooled psycopg connection and hand it back afterwards."""
+        with self._get_pool().connection() as conn:
             yield conn
-        finally:
-            conn.close()
 
     def ensure_tables_exist(self) -> None:
         """Create tables if they don't exist (idempotent)."""
@@ -36,12 +71,13 @@ class PostgresDB:
                     timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                     sys INTEGER NOT NULL,
                     dia INTEGER NOT NULL,
-                    hr INTEGER NOT NULL
+                    hr INTEGER NOT NULL,
+                    bp_guidance TEXT
                 );
+                ALTER TABLE bp_readings ADD COLUMN IF NOT EXISTS bp_guidance TEXT;
                 CREATE INDEX IF NOT EXISTS idx_bp_readings_timestamp
                     ON bp_readings(timestamp DESC);
             """)
-            conn.commit()
 
     def insert_reading(
         self, sys: int, dia: int, hr: int, timestamp: date | datetime | None = None
@@ -77,34 +113,105 @@ class PostgresDB:
                     """,
                     (sys, dia, hr),
                 )
-            reading_id = cur.fetchone()[0]
-            conn.commit()
-            return reading_id
+            return cur.fetchone()[0]
 
-    def get_recent_readings(self, limit: int = 10) -> list[dict]:
+    def insert_and_fetch_recent(
+        self,
+        sys: int,
+        dia: int,
+        hr: int,
+        timestamp: date | datetime | None = None,
+        limit: int = 10,
+    ) -> tuple[int, pd.DataFrame]:
         """
-        Get recent blood pressure readings from the database.
+        Insert a reading and return the most recent readings in one round trip.
 
         Args:
+            sys: Systolic blood pressure
+            dia: Diastolic blood pressure
+            hr: Heart rate
+            timestamp: Optional timestamp (defaults to current time)
             limit: Maximum number of readings to return
 
         Returns:
-            List of dictionaries containing reading data
+            The ID of the inserted reading and a DataFrame of reading data,
+            newest first, including the new one
         """
+        with self.connection() as conn:
+            # Pipeline mode ships both statements before waiting on either,
+            # and the SELECT sees the new row because it runs after the INSERT.
+            with conn.pipeline():
+                insert_cur = conn.execute(
+                    """
+                    INSERT INTO bp_readings (timestamp, sys, dia, hr)
+                    VALUES (COALESCE(%s, CURRENT_TIMESTAMP), %s, %s, %s)
+                    RETURNING id
+                    """,
+                    (timestamp, sys, dia, hr),
+                )
+                cur = conn.execute(_RECENT_READINGS_SQL, (limit,), prepare=True)
+                return insert_cur.fetchone()[0], _fetch_frame(cur)
+
+    def save_guidance(self, guidance: Mapping[int, str]) -> None:
+        """
+        Store generated guidance text on existing readings.
+
+        Args:
+            guidance: Guidance text keyed by reading ID
+        """
+        if not guidance:
+            return
         with (
             self.connection() as conn,
-            conn.cursor(cursor_factory=RealDictCursor) as cur,
+            conn.transaction(),
+            conn.cursor() as cur,
         ):
+            # psycopg pipelines executemany, so this is one round trip.
+            cur.executemany(
+                "UPDATE bp_readings SET bp_guidance = %s WHERE id = %s",
+                [(text, reading_id) for reading_id, text in guidance.items()],
+            )
+
+    def get_recent_readings(self, limit: int = 10) -> pd.DataFrame:
+        """
+        Get recent blood pressure readings from the database.
+
+        Args:
+            limit: Maximum number of readings to return
+
+        Returns:
+            DataFrame of reading data, newest first
+        """
+        with self.connection() as conn, conn.cursor() as cur:
+            # psycopg prepares this server-side once per connection and reuses
+            # the plan on later calls, so reruns skip parse/plan.
+            cur.execute(_RECENT_READINGS_SQL, (limit,), prepare=True)
+            return _fetch_frame(cur)
+
+    def get_readings_between(
+        self, start: date | datetime, end: date | datetime
+    ) -> pd.DataFrame:
+        """
+        Get blood pressure readings taken in a time window, e.g. for backfills.
+
+        Args:
+            start: Inclusive lower bound on the reading timestamp
+            end: Exclusive upper bound on the reading timestamp
+
+        Returns:
+            DataFrame of reading data, oldest first
+        """
+        with self.connection() as conn, conn.cursor() as cur:
             cur.execute(
                 """
                 SELECT id, timestamp, sys, dia, hr
                 FROM bp_readings
-                ORDER BY timestamp DESC
-                LIMIT %s
+                WHERE timestamp >= %s AND timestamp < %s
+                ORDER BY timestamp
                 """,
-                (limit,),
+                (start, end),
             )
-            return [dict(row) for row in cur.fetchall()]
+            return _fetch_frame(cur)
 
     def get_latest_reading(self) -> dict | None:
         """
@@ -114,4 +221,4 @@ class PostgresDB:
             Dictionary containing the latest reading, or None if no readings exist
         """
         readings = self.get_recent_readings(limit=1)
-        return readings[0] if readings else None
+        return None if readings.empty else readings.iloc[0].to_dict()
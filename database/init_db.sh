@@ -19,13 +19,16 @@ CREATE TABLE IF NOT EXISTS bp_readings (
     timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     sys INTEGER NOT NULL,
     dia INTEGER NOT NULL,
-    hr INTEGER NOT NULL
+    hr INTEGER NOT NULL,
+    bp_guidance TEXT
 );
 
+ALTER TABLE bp_readings ADD COLUMN IF NOT EXISTS bp_guidance TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_bp_readings_timestamp ON bp_readings(timestamp DESC);
 
 EOF
 
 echo "Database initialized successfully!"
-echo "Table bp_readings created with columns: id, timestamp, sys, dia, hr"
+echo "Table bp_readings created with columns: id, timestamp, sys, dia, hr, bp_guidance"
 
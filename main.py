@@ -1,15 +1,39 @@
 """Streamlit entrypoint for the No Pressure prototype app."""
 
 import datetime as dt
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
 
-from agent.bp_agent import BPAgent
+from agent.bp_agent import TRUNCATION_NOTICE, BPAgent
 from database import PostgresDB
 
 load_dotenv(".env.local")
 
+# Streamlit only configures its own loggers, so without a handler the agent's
+# INFO lines (e.g. prompt-cache hit rates) are dropped. The guard stops reruns
+# from stacking duplicate handlers.
+_agent_logger = logging.getLogger("agent")
+if not _agent_logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    _agent_logger.addHandler(_log_handler)
+    _agent_logger.setLevel(logging.INFO)
+    _agent_logger.propagate = False
+
+# Vitals shown as metrics, in the order their deltas are computed.
+_METRIC_COLUMNS = ["sys", "dia", "hr"]
+
+# Column labels and timestamp format for the Recent Readings table.
+_TABLE_COLUMNS = {"sys": "Sys", "dia": "Dia", "hr": "HR"}
+_TABLE_DATE_FORMAT = "%Y-%m-%d %H:%M"
+
 st.set_page_config(
     page_title="No Pressure (Blood Pressure AI Assistant)",
     page_icon="🩺",
@@ -31,61 +55,72 @@ def get_bp_agent() -> BPAgent:
     return BPAgent()
 
 
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_recent(_database: PostgresDB, limit: int, version: int) -> pd.DataFrame:
+    """Load recent readings; ``version`` only exists to key the cache."""
+    return _database.get_recent_readings(limit=limit)
+
+
 def fetch_recent_data(
     database: PostgresDB, limit: int = 10
-) -> tuple[list[dict], Exception | None]:
+) -> tuple[pd.DataFrame, Exception | None]:
     """Return recent readings and a potential error."""
     try:
-        return database.get_recent_readings(limit=limit), None
+        version = st.session_state.get("bp_version", 0)
+        return _cached_recent(database, limit, version), None
     except Exception as exc:  # pragma: no cover - surface to UI
-        return [], exc
+        return pd.DataFrame(), exc
 
 
-def split_latest_previous(
-    readings: list[dict],
+def latest_and_deltas(
+    readings: pd.DataFrame,
 ) -> tuple[dict | None, dict | None]:
-    """Return the latest and previous readings from a list."""
-    latest = readings[0] if readings else None
-    previous = readings[1] if len(readings) > 1 else None
-    return latest, previous
+    """Return the latest vitals and their change since the previous reading."""
+    if readings.empty:
+        return None, None
+    vitals = readings[_METRIC_COLUMNS]
+    latest = vitals.iloc[0]
+    if len(vitals) < 2:
+        return latest.to_dict(), None
+    return latest.to_dict(), (latest - vitals.iloc[1]).to_dict()
 
 
-def format_value(reading: dict | None, key: str) -> str:
+def format_value(latest: dict | None, key: str) -> str:
     """Format the metric value for display."""
-    if not reading:
+    if latest is None:
         return "--"
-    return str(reading[key])
+    return str(latest[key])
 
 
-def format_delta(latest: dict | None, previous: dict | None, key: str) -> str:
-    """Format the delta string between two readings."""
-    if not latest or not previous:
+def format_delta(deltas: dict | None, key: str) -> str:
+    """Format the delta string against the previous reading."""
+    if deltas is None:
         return "N/A"
-    delta = latest[key] - previous[key]
+    delta = deltas[key]
     prefix = "+" if delta > 0 else ""
     return f"{prefix}{delta} vs last"
 
 
-def render_metrics(placeholder, latest: dict | None, previous: dict | None) -> None:
+def render_metrics(placeholder, latest: dict | None, deltas: dict | None) -> None:
     """Render the trio of metrics with current readings."""
     with placeholder.container():
         col1, col2, col3 = st.columns(3)
         col1.metric(
             "Systolic (mmHg)",
             format_value(latest, "sys"),
-            format_delta(latest, previous, "sys"),
+            format_delta(deltas, "sys"),
             delta_color="inverse",
         )
         col2.metric(
             "Diastolic (mmHg)",
             format_value(latest, "dia"),
-            format_delta(latest, previous, "dia"),
+            format_delta(deltas, "dia"),
             delta_color="inverse",
         )
         col3.metric(
             "Heart Rate (bpm)",
             format_value(latest, "hr"),
-            format_delta(latest, previous, "hr"),
+            format_delta(deltas, "hr"),
             delta_color="inverse",
         )
 
@@ -103,8 +138,8 @@ def main() -> None:
 
     metrics_placeholder = st.empty()
     recent_readings, load_error = fetch_recent_data(db)
-    latest_reading, previous_reading = split_latest_previous(recent_readings)
-    render_metrics(metrics_placeholder, latest_reading, previous_reading)
+    latest_reading, reading_deltas = latest_and_deltas(recent_readings)
+    render_metrics(metrics_placeholder, latest_reading, reading_deltas)
 
     with st.sidebar:
         st.header("Session Controls")
@@ -136,55 +171,67 @@ def main() -> None:
         submitted = st.form_submit_button("Generate Guidance", use_container_width=True)
 
     if submitted:
-        with st.spinner("Generating guidance..."):
-            guidance = bp_agent.generate_guidance(
-                systolic, diastolic, heart_rate, symptoms
-            )
-
-        try:
-            timestamp_value = dt.datetime.combine(timestamp, reading_time)
-            db.insert_reading(
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Elements can only be written from the script thread, so the
+            # insert runs on the worker while the guidance streams here over
+            # the agent's shared HTTP/2 pool.
+            insert_future = executor.submit(
+                db.insert_and_fetch_recent,
                 sys=systolic,
                 dia=diastolic,
                 hr=heart_rate,
-                timestamp=timestamp_value,
+                timestamp=dt.datetime.combine(timestamp, reading_time),
             )
+            try:
+                guidance = st.write_stream(
+                    bp_agent.generate_guidance(
+                        systolic, diastolic, heart_rate, symptoms
+                    )
+                )
+            except Exception as exc:  # pragma: no cover - surface to UI
+                guidance = None
+                st.error(f"Failed to generate guidance: {exc}")
+
+        try:
+            reading_id, recent_readings = insert_future.result()
+        except Exception as exc:  # pragma: no cover - surface to UI
+            st.error(f"Failed to save reading: {exc}")
+        else:
+            load_error = None
+            # A truncated report may be missing its disclaimer, so it is shown
+            # with the notice but not stored.
+            if guidance and not guidance.endswith(TRUNCATION_NOTICE):
+                try:
+                    db.save_guidance({reading_id: guidance})
+                except Exception as exc:  # pragma: no cover - surface to UI
+                    st.error(f"Failed to save guidance: {exc}")
+            # A fresh token per insert: a per-session counter could collide
+            # with another session's token and replay its stale cache entry.
+            st.session_state["bp_version"] = time.time_ns()
             st.success(
                 f"Logged {systolic}/{diastolic} with heart rate {heart_rate} on "
                 f"{timestamp:%b %d, %Y}.",
                 icon="✅",
             )
-            recent_readings, load_error = fetch_recent_data(db)
-            latest_reading, previous_reading = split_latest_previous(recent_readings)
-            render_metrics(metrics_placeholder, latest_reading, previous_reading)
-        except Exception as exc:  # pragma: no cover - surface to UI
-            st.error(f"Failed to save reading: {exc}")
-        else:
-            st.info(guidance, icon="💡")
+            latest_reading, reading_deltas = latest_and_deltas(recent_readings)
+            render_metrics(metrics_placeholder, latest_reading, reading_deltas)
 
     st.subheader("Recent Readings")
     if load_error:
         st.error(f"Unable to load readings: {load_error}")
         return
 
-    formatted_readings = [
-        {
-            "Date": (
-                row["timestamp"].strftime("%Y-%m-%d %H:%M")
-                if hasattr(row["timestamp"], "strftime")
-                else str(row["timestamp"])
-            ),
-            "Sys": row["sys"],
-            "Dia": row["dia"],
-            "HR": row["hr"],
-        }
-        for row in recent_readings
-    ]
-
-    if formatted_readings:
-        st.dataframe(formatted_readings, use_container_width=True, hide_index=True)
-    else:
+    if recent_readings.empty:
         st.info("No readings recorded yet.")
+        return
+
+    formatted_readings = recent_readings[list(_TABLE_COLUMNS)].rename(
+        columns=_TABLE_COLUMNS
+    )
+    formatted_readings.insert(
+        0, "Date", recent_readings["timestamp"].dt.strftime(_TABLE_DATE_FORMAT)
+    )
+    st.dataframe(formatted_readings, use_container_width=True, hide_index=True)
 
 
 if __name__ == "__main__":